@@ -1,4 +1,10 @@
+import argparse
+import json
 import math
+import os
+import sys
+import threading
+import time
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
@@ -17,6 +23,12 @@ REAR_AXLE_Z = WHEELBASE / 2.0
 FRONT_WING_Z = FRONT_AXLE_Z - 1.0
 REAR_WING_Z = REAR_AXLE_Z + 0.7
 
+TRACK_HALF_LENGTH = 2000.0
+TRACK_DASH_LENGTH = 4.0
+TRACK_DASH_GAP = 4.0
+TRACK_PATTERN = TRACK_DASH_LENGTH + TRACK_DASH_GAP
+CAR_WRAP_DISTANCE = 256.0
+
 BLACK_MAIN = (0.12, 0.12, 0.14)
 BLACK_PLANK = (0.06, 0.06, 0.07)
 DARK_GREY = (0.25, 0.25, 0.28)
@@ -517,8 +529,8 @@ def draw_car(wheel_angle, drs_open):
 def draw_track():
     track_width = 10.0
     half_width = track_width / 2.0
-    z_min = -2000.0
-    z_max = 2000.0
+    z_min = -TRACK_HALF_LENGTH
+    z_max = TRACK_HALF_LENGTH
     y_grass = -0.1
     y_asphalt = 0.0
     y_edge = 0.05
@@ -553,8 +565,8 @@ def draw_track():
     glEnd()
     glColor3f(1.0, 1.0, 1.0)
     line_width = 0.25
-    segment_length = 4.0
-    gap = 4.0
+    segment_length = TRACK_DASH_LENGTH
+    gap = TRACK_DASH_GAP
     z = z_min
     while z < z_max:
         glBegin(GL_QUADS)
@@ -565,17 +577,151 @@ def draw_track():
         glEnd()
         z += segment_length + gap
 
-def create_text_texture(text, font, color=(255, 255, 255)):
+class GLResources:
+    # Owns every texture, buffer and display list. The CPU-side data of each
+    # resource is retained so the whole set can be rebuilt after a context loss.
+
+    KINDS = ("texture", "buffer", "list")
+    # Display lists are opaque to the driver, so their size is estimated from
+    # the vertex count given to add_list (position + color).
+    LIST_VERTEX_BYTES = 24
+
+    def __init__(self):
+        self.entries = {}
+        self.names = {}
+
+    def add_texture(self, key, width, height, data):
+        self.release(key)
+        entry = {"kind": "texture", "width": width, "height": height, "data": data, "bytes": width * height * 4}
+        name = glGenTextures(1)
+        self._upload_texture(name, entry)
+        self.entries[key] = entry
+        self.names[key] = name
+        return key
+
+    def add_buffer(self, key, data, target=GL_ARRAY_BUFFER, usage=GL_STATIC_DRAW):
+        self.release(key)
+        entry = {"kind": "buffer", "target": target, "usage": usage, "data": data, "bytes": len(data)}
+        name = glGenBuffers(1)
+        self._upload_buffer(name, entry)
+        self.entries[key] = entry
+        self.names[key] = name
+        return key
+
+    def add_list(self, key, build, vertices):
+        self.release(key)
+        entry = {"kind": "list", "build": build, "bytes": vertices * self.LIST_VERTEX_BYTES}
+        name = glGenLists(1)
+        self._compile_list(name, entry)
+        self.entries[key] = entry
+        self.names[key] = name
+        return key
+
+    def get(self, key):
+        return self.names[key]
+
+    def release(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        name = self.names.pop(key)
+        if entry["kind"] == "texture":
+            glDeleteTextures([name])
+        elif entry["kind"] == "buffer":
+            glDeleteBuffers(1, [name])
+        else:
+            glDeleteLists(name, 1)
+
+    def release_all(self):
+        for key in list(self.entries):
+            self.release(key)
+
+    def memory_usage(self):
+        usage = {}
+        for kind in self.KINDS:
+            usage[kind] = {"count": 0, "bytes": 0}
+        for entry in self.entries.values():
+            usage[entry["kind"]]["count"] += 1
+            usage[entry["kind"]]["bytes"] += entry["bytes"]
+        return usage
+
+    def print_usage(self):
+        print("Recursos OpenGL:")
+        for kind, usage in self.memory_usage().items():
+            print("  %-8s %4d  %8.1f KiB" % (kind, usage["count"], usage["bytes"] / 1024.0))
+
+    def context_lost(self):
+        # All resources share one context, so probing a single name is enough.
+        if not self.entries:
+            return False
+        key = next(iter(self.entries))
+        kind = self.entries[key]["kind"]
+        name = self.names[key]
+        if kind == "texture":
+            return not glIsTexture(name)
+        if kind == "buffer":
+            return not glIsBuffer(name)
+        return not glIsList(name)
+
+    def rebuild(self):
+        # The old names died with the previous context, so they are dropped
+        # without glDelete* and every kind is regenerated in a single batch.
+        by_kind = {}
+        for kind in self.KINDS:
+            by_kind[kind] = [key for key, entry in self.entries.items() if entry["kind"] == kind]
+        textures = by_kind["texture"]
+        if textures:
+            names = glGenTextures(len(textures))
+            if len(textures) == 1:
+                names = [names]
+            for key, name in zip(textures, names):
+                self._upload_texture(name, self.entries[key])
+                self.names[key] = name
+        buffers = by_kind["buffer"]
+        if buffers:
+            names = glGenBuffers(len(buffers))
+            if len(buffers) == 1:
+                names = [names]
+            for key, name in zip(buffers, names):
+                self._upload_buffer(name, self.entries[key])
+                self.names[key] = name
+        lists = by_kind["list"]
+        if lists:
+            base = glGenLists(len(lists))
+            for i, key in enumerate(lists):
+                self._compile_list(base + i, self.entries[key])
+                self.names[key] = base + i
+
+    def _upload_texture(self, name, entry):
+        glBindTexture(GL_TEXTURE_2D, name)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, entry["width"], entry["height"], 0, GL_RGBA, GL_UNSIGNED_BYTE, entry["data"])
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def _upload_buffer(self, name, entry):
+        glBindBuffer(entry["target"], name)
+        glBufferData(entry["target"], len(entry["data"]), entry["data"], entry["usage"])
+        glBindBuffer(entry["target"], 0)
+
+    def _compile_list(self, name, entry):
+        glNewList(name, GL_COMPILE)
+        entry["build"]()
+        glEndList()
+
+def wrap_car_z(car_z):
+    # The track repeats every TRACK_PATTERN units, so moving the car back by a
+    # multiple of it looks identical and keeps the cached track valid as-is.
+    if abs(car_z) < CAR_WRAP_DISTANCE:
+        return car_z
+    return car_z - round(car_z / TRACK_PATTERN) * TRACK_PATTERN
+
+def create_text_texture(resources, key, text, font, color=(255, 255, 255)):
     surface = font.render(text, True, color)
     text_data = pygame.image.tostring(surface, "RGBA", True)
     width, height = surface.get_size()
-    tex_id = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, tex_id)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, text_data)
-    glBindTexture(GL_TEXTURE_2D, 0)
-    return tex_id, width, height
+    resources.add_texture(key, width, height, text_data)
+    return key, width, height
 
 def draw_textured_quad_2d(tex_id, x, y, w, h, window_width, window_height):
     glMatrixMode(GL_PROJECTION)
@@ -606,6 +752,236 @@ def draw_textured_quad_2d(tex_id, x, y, w, h, window_width, window_height):
     glPopMatrix()
     glMatrixMode(GL_MODELVIEW)
 
+class SamplingProfiler:
+    # Samples the main thread's stack from a background thread. Each sample is
+    # rooted at the frame-loop stage that was active when it was taken and is
+    # weighted by the wall time since the previous sample. The sampler can only
+    # run when it gets the GIL, so the switch interval is lowered to the sample
+    # interval while profiling; otherwise up to 5 ms of busy Python time would
+    # be charged to whatever stack is seen next (usually a GL call or flip).
+
+    def __init__(self, path, interval=0.001):
+        self.path = path
+        self.interval = interval
+        self.stage = "setup"
+        self.stacks = {}
+        self.stage_times = {}
+        self.target_id = None
+        self.running = False
+        self.thread = None
+        self.saved_switch_interval = None
+
+    def start(self):
+        self.target_id = threading.get_ident()
+        self.saved_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(self.interval)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def set_stage(self, stage):
+        self.stage = stage
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        sys.setswitchinterval(self.saved_switch_interval)
+        self.write()
+        self.print_stages()
+
+    def _run(self):
+        last = time.perf_counter()
+        while self.running:
+            frame = sys._current_frames().get(self.target_id)
+            stage = self.stage
+            now = time.perf_counter()
+            elapsed = now - last
+            last = now
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append((stage, "", 0))
+                stack.reverse()
+                stack = tuple(stack)
+                self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed
+                self.stage_times[stage] = self.stage_times.get(stage, 0.0) + elapsed
+            time.sleep(self.interval)
+
+    def write(self):
+        if self.path.endswith(".json"):
+            self.write_speedscope()
+        else:
+            self.write_collapsed()
+
+    def write_collapsed(self):
+        with open(self.path, "w") as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                names = [name if not filename else "%s (%s:%d)" % (name, filename, line) for name, filename, line in stack]
+                f.write("%s %d\n" % (";".join(names), round(seconds * 1000000)))
+
+    def write_speedscope(self):
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, seconds in self.stacks.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    name, filename, line = frame
+                    frames.append({"name": name, "file": filename, "line": line} if filename else {"name": name})
+                indices.append(frame_index[frame])
+            samples.append(indices)
+            weights.append(seconds)
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": "FormulaP2 main thread",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": "FormulaP2",
+            "exporter": "FormulaP2 SamplingProfiler",
+        }
+        with open(self.path, "w") as f:
+            json.dump(document, f)
+
+    def print_stages(self):
+        total = sum(self.stage_times.values())
+        if total == 0:
+            return
+        print("Tempo por etapa do loop (%.2f s no total):" % total)
+        for stage, seconds in sorted(self.stage_times.items(), key=lambda item: -item[1]):
+            print("  %-8s %8.3f s  %5.1f%%" % (stage, seconds, 100.0 * seconds / total))
+
+SCENARIO_KEYS = {
+    "SPACE": K_SPACE,
+    "D": K_d,
+    "UP": K_UP,
+    "DOWN": K_DOWN,
+    "LEFT": K_LEFT,
+    "RIGHT": K_RIGHT,
+    "ESCAPE": K_ESCAPE,
+}
+
+class LiveInput:
+    def __init__(self, clock):
+        self.clock = clock
+
+    def tick(self):
+        return self.clock.tick(60) / 1000.0
+
+    def events(self):
+        return pygame.event.get()
+
+    def pressed(self):
+        return pygame.key.get_pressed()
+
+    def mouse_rel(self):
+        return pygame.mouse.get_rel()
+
+class HeldKeys:
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return key in self.held
+
+class ScenarioInput:
+    # Replays a scenario file at a fixed timestep instead of reading the real
+    # keyboard and mouse, and records the wall-clock time of every frame.
+
+    def __init__(self, path):
+        with open(path) as f:
+            scenario = json.load(f)
+        self.name = scenario.get("name", os.path.basename(path))
+        self.duration = float(scenario["duration"])
+        self.dt = float(scenario.get("dt", 1.0 / 60.0))
+        self.pending = sorted(scenario.get("events", []), key=lambda entry: entry["t"])
+        self.frame = 0
+        self.time = 0.0
+        self.held = {}
+        self.orbits = []
+        self.mouse = [0.0, 0.0]
+        self.last_tick = None
+        self.frame_times = []
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last_tick is not None:
+            self.frame_times.append(now - self.last_tick)
+        self.last_tick = now
+        self.frame += 1
+        self.time = self.frame * self.dt
+        return self.dt
+
+    def events(self):
+        events = [event for event in pygame.event.get()
+                  if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE)]
+        if self.time >= self.duration:
+            events.append(pygame.event.Event(QUIT))
+            return events
+        while self.pending and self.pending[0]["t"] <= self.time:
+            entry = self.pending.pop(0)
+            if "key" in entry:
+                key = SCENARIO_KEYS[entry["key"]]
+                events.append(pygame.event.Event(KEYDOWN, key=key, mod=0))
+                if "hold" in entry:
+                    self.held[key] = entry["t"] + float(entry["hold"])
+                else:
+                    events.append(pygame.event.Event(KEYUP, key=key, mod=0))
+            elif "mouse" in entry:
+                dx, dy = entry["mouse"]
+                if "duration" in entry:
+                    self.orbits.append((entry["t"] + float(entry["duration"]), dx, dy))
+                else:
+                    self.mouse[0] += dx
+                    self.mouse[1] += dy
+            elif "zoom" in entry:
+                events.append(pygame.event.Event(MOUSEWHEEL, x=0, y=entry["zoom"]))
+            elif "resize" in entry:
+                w, h = entry["resize"]
+                events.append(pygame.event.Event(VIDEORESIZE, w=w, h=h, size=(w, h)))
+        for key, release in list(self.held.items()):
+            if release <= self.time:
+                del self.held[key]
+                events.append(pygame.event.Event(KEYUP, key=key, mod=0))
+        self.orbits = [orbit for orbit in self.orbits if orbit[0] > self.time]
+        for _, dx, dy in self.orbits:
+            self.mouse[0] += dx
+            self.mouse[1] += dy
+        return events
+
+    def pressed(self):
+        return HeldKeys(self.held)
+
+    def mouse_rel(self):
+        mx, my = self.mouse
+        self.mouse = [0.0, 0.0]
+        return mx, my
+
+    def print_report(self):
+        times = sorted(self.frame_times)
+        if not times:
+            return
+        n = len(times)
+        total = sum(times)
+        def percentile(p):
+            return times[min(n - 1, int(round(p * (n - 1))))] * 1000.0
+        print("Cenario '%s': %d frames, %d intervalos entre frames em %.2f s (%.1f FPS)" % (
+            self.name, self.frame, n, total, n / total))
+        print("  intervalo ms: media %.2f  p50 %.2f  p95 %.2f  p99 %.2f  max %.2f" % (
+            total / n * 1000.0, percentile(0.50), percentile(0.95), percentile(0.99), times[-1] * 1000.0))
+
 def init_opengl(width, height):
     glViewport(0, 0, width, height)
     glMatrixMode(GL_PROJECTION)
@@ -618,7 +994,8 @@ def init_opengl(width, height):
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
     glClearColor(0.35, 0.55, 0.90, 1.0)
 
-def main():
+def main(profiler=None, scenario=None):
+    set_stage = profiler.set_stage if profiler else lambda stage: None
     pygame.init()
     pygame.display.set_caption("CG - F1 Mercedes W12 (PyOpenGL + pygame)")
     pygame.font.init()
@@ -626,16 +1003,21 @@ def main():
     screen = pygame.display.set_mode(window_size, DOUBLEBUF | OPENGL | RESIZABLE)
     init_opengl(window_size[0], window_size[1])
     clock = pygame.time.Clock()
+    input_source = scenario if scenario else LiveInput(clock)
     font = pygame.font.SysFont("Arial", 18, bold=True)
     help_lines = [
         "ESPACO: iniciar/pausar animacao    D: alternar DRS",
         "Setas CIMA/BAIXO: acelerar/frear    Scroll do mouse: zoom",
         "ESC: sair    Mouse: orbita camera"
     ]
+    resources = GLResources()
     help_textures = []
-    for line in help_lines:
-        tex_id, w, h = create_text_texture(line, font)
-        help_textures.append((tex_id, w, h))
+    for i, line in enumerate(help_lines):
+        key, w, h = create_text_texture(resources, ("help", i), line, font)
+        help_textures.append((key, w, h))
+    # Grass, asphalt and the two edges, plus one quad per centre dash.
+    track_quads = 4 + int(2.0 * TRACK_HALF_LENGTH / TRACK_PATTERN)
+    resources.add_list("track", draw_track, vertices=track_quads * 4)
     running = True
     animation_running = False
     animation_finished = False
@@ -654,18 +1036,23 @@ def main():
     camera_distance = 10.0
     mouse_sensitivity = 0.15
     zoom_step = 1.0
-    pygame.mouse.set_visible(False)
-    pygame.event.set_grab(True)
+    if not scenario:
+        pygame.mouse.set_visible(False)
+        pygame.event.set_grab(True)
     pygame.mouse.get_rel()
     while running:
-        dt = clock.tick(60) / 1000.0
-        for event in pygame.event.get():
+        set_stage("tick")
+        dt = input_source.tick()
+        set_stage("events")
+        for event in input_source.events():
             if event.type == QUIT:
                 running = False
             elif event.type == VIDEORESIZE:
                 window_size[0], window_size[1] = event.w, event.h
                 screen = pygame.display.set_mode(window_size, DOUBLEBUF | OPENGL | RESIZABLE)
                 init_opengl(window_size[0], window_size[1])
+                if resources.context_lost():
+                    resources.rebuild()
             elif event.type == KEYDOWN:
                 if event.key == K_ESCAPE:
                     running = False
@@ -677,7 +1064,8 @@ def main():
                     drs_open = not drs_open
             elif event.type == MOUSEWHEEL:
                 camera_distance -= event.y * zoom_step
-        keys = pygame.key.get_pressed()
+        set_stage("update")
+        keys = input_source.pressed()
         if keys[K_LEFT]:
             steer_angle += 40.0 * dt
         if keys[K_RIGHT]:
@@ -703,11 +1091,13 @@ def main():
         car_speed = max(0.0, min(car_speed, max_speed))
         distance_step = car_speed * dt
         car_z -= distance_step
+        car_z = wrap_car_z(car_z)
         travel_distance += distance_step
         wheel_circumference = 2.0 * math.pi * WHEEL_RADIUS
         if wheel_circumference > 0:
             wheel_angle += (distance_step / wheel_circumference) * 360.0
-        mx, my = pygame.mouse.get_rel()
+        set_stage("camera")
+        mx, my = input_source.mouse_rel()
         camera_yaw -= mx * mouse_sensitivity
         camera_pitch -= my * mouse_sensitivity
         camera_pitch = max(-80.0, min(80.0, camera_pitch))
@@ -724,19 +1114,45 @@ def main():
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
         gluLookAt(cam_x, cam_y, cam_z, target_x, target_y, target_z, 0.0, 1.0, 0.0)
-        draw_track()
+        set_stage("track")
+        glCallList(resources.get("track"))
+        set_stage("car")
         glPushMatrix()
         glTranslatef(0.0, 0.0, car_z)
         glRotatef(steer_angle, 0, 1, 0)
         draw_car(wheel_angle, drs_open)
         glPopMatrix()
-        for i, (tex_id, tw, th) in enumerate(help_textures):
+        set_stage("hud")
+        for i, (key, tw, th) in enumerate(help_textures):
             margin = 10
             x = margin
             y = window_size[1] - (th + margin) - i * (th + 4)
-            draw_textured_quad_2d(tex_id, x, y, tw, th, window_size[0], window_size[1])
+            draw_textured_quad_2d(resources.get(key), x, y, tw, th, window_size[0], window_size[1])
+        set_stage("flip")
         pygame.display.flip()
+    if profiler or scenario:
+        resources.print_usage()
+    resources.release_all()
     pygame.quit()
 
+def run(profile_path=None, scenario_path=None):
+    profiler = SamplingProfiler(profile_path) if profile_path else None
+    scenario = ScenarioInput(scenario_path) if scenario_path else None
+    if profiler:
+        profiler.start()
+    try:
+        main(profiler, scenario)
+    finally:
+        if profiler:
+            profiler.stop()
+        if scenario:
+            scenario.print_report()
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="CG - F1 Mercedes W12 (PyOpenGL + pygame)")
+    parser.add_argument("--profile", metavar="ARQUIVO", default=os.environ.get("F1_PROFILE"),
+                        help="ativa o profiler por amostragem; .json gera speedscope, outra extensao gera collapsed stacks")
+    parser.add_argument("--scenario", metavar="ARQUIVO",
+                        help="reproduz um cenario JSON com passo de tempo fixo e imprime as estatisticas de frame")
+    args = parser.parse_args()
+    run(profile_path=args.profile, scenario_path=args.scenario)